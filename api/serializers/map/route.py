@@ -25,6 +25,7 @@ class POIRouteSerializer(serializers.Serializer):
     )
     type = serializers.ChoiceField(choices=POI_CHOICES)
     point = PointSerializer()
+    include_metadata = serializers.BooleanField(default=False)
 
 
 # noinspection PyAbstractClass
@@ -37,3 +38,4 @@ class SearchSerializer(serializers.Serializer):
 class ConcreteRouteSerializer(serializers.Serializer):
     start_point = PointSerializer()
     end_point = PointSerializer()
+    include_metadata = serializers.BooleanField(default=False)
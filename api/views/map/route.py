@@ -1,17 +1,24 @@
+import hashlib
+import logging
 import math
+from concurrent.futures import ThreadPoolExecutor
 
-from geojson import LineString, Point
+import numpy as np
+from django.core.cache import cache, caches
 from geomet import wkt
-from geopy.distance import great_circle
 from rest_framework import views
 from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 
 from api.serializers.map.route import ConcreteRouteSerializer, POIRouteSerializer
-from utils.double_gis.geometry import get_center_of_points, get_normal_vector
+from utils.double_gis.geometry import (LL, get_center_of_points, get_great_circle_distance,
+                                       get_great_circle_distances, get_normal_vector,
+                                       parse_linestring)
 from utils.double_gis.service import DoubleGisService
 
+logger = logging.getLogger(__name__)
+
 
 class AbstractRouteView(views.APIView):
     SPEED = 3 * 1000 / 60  # метры в минуту
@@ -19,53 +26,89 @@ class AbstractRouteView(views.APIView):
     api = DoubleGisService().get_api()
     AVERAGE_STRIDE_LENGTH = 0.6  # в метрах
     METADATA_ROUTE_POINTS_COUNT = 4
+    METADATA_SEARCH_RADIUS = 100  # в метрах
+    # Пул для параллельных запросов к 2GIS, общий для всех запросов процесса
+    executor = ThreadPoolExecutor(max_workers=8)
+    SEARCH_CACHE_TIMEOUT = 7 * 24 * 60 * 60  # в секундах
+    SEARCH_CACHE_PRECISION = 3  # знаков после запятой, примерно 100 метров
+    ROUTE_CACHE_TIMEOUT = 60 * 60  # в секундах
+    EDGE_FILTER = 'pedestrian'
 
     def points_to_query(self, points):
-        str_points = ['{} {}'.format(*point['coordinates']) for point in points]
-        return ','.join(str_points)
+        # str.join всё равно собирает генератор в список, поэтому список здесь быстрее
+        return ','.join(['%s %s' % point for point in points])
+
+    def cached_search(self, search, points, **params):
+        # points - словарь {имя параметра: точка}. В ключ кэша координаты попадают
+        # округлёнными, так что для близких точек переиспользуется один ответ 2GIS
+        quantized_points = sorted(
+            (name, (round(point.lon, self.SEARCH_CACHE_PRECISION),
+                    round(point.lat, self.SEARCH_CACHE_PRECISION)))
+            for name, point in points.items()
+        )
+        raw_key = repr((str(search), quantized_points, sorted(params.items())))
+        cache_key = 'double_gis:{}'.format(hashlib.md5(raw_key.encode()).hexdigest())
+        response = cache.get(cache_key)
+        if response is None:
+            for name, point in points.items():
+                params[name] = point.qstr
+            response = search(**params)
+            if response['meta']['code'] == 200:
+                cache.set(cache_key, response, self.SEARCH_CACHE_TIMEOUT)
+        return response
 
     def estimate_walking_time(self, point1, point2):
         # Время в минутах
-        return great_circle(point1['coordinates'], point2['coordinates']).meters / self.SPEED
+        return get_great_circle_distance(point1, point2) / self.SPEED
 
-    def serialize_linestring(self, linestring):
+    def serialize_linestring(self, positions):
         result = [
             {
                 'longitude': position[0],
                 'latitude': position[1]
-            } for position in linestring['coordinates']
+            } for position in positions
             ]
         return result
 
     def get_points_for_round_route(self, start_point, end_point):
-        center_point_coordinates = get_center_of_points(start_point, end_point)
+        center_point = get_center_of_points(start_point, end_point)
         normal_vector = get_normal_vector(start_point, end_point)
-        second_point = Point((center_point_coordinates[0] + normal_vector[0],
-                              center_point_coordinates[1] + normal_vector[1]))
-        fourth_point = Point((center_point_coordinates[0] - normal_vector[0],
-                              center_point_coordinates[1] - normal_vector[1]))
+        second_point = LL(*(center_point + normal_vector).tolist())
+        fourth_point = LL(*(center_point - normal_vector).tolist())
         return start_point, second_point, end_point, fourth_point, start_point
 
-    def build_route(self, points, alternative=0):
+    def build_routes(self, points, alternative=0):
+        # Основной маршрут и до alternative альтернативных, 2GIS возвращает их одним ответом
         query_points = self.points_to_query(points)
+        raw_key = '{}|{}|{}'.format(query_points, self.EDGE_FILTER, alternative)
+        cache_key = 'routes:{}'.format(hashlib.sha1(raw_key.encode()).hexdigest())
+        # Не get_or_set: при недоступном Redis django-redis возвращает None вместо значения
+        routes_positions = caches['routes'].get(cache_key)
+        if routes_positions is None:
+            routes_positions = self._calculate_routes_positions(query_points, alternative)
+            caches['routes'].set(cache_key, routes_positions, self.ROUTE_CACHE_TIMEOUT)
+        return routes_positions
+
+    def _calculate_routes_positions(self, query_points, alternative):
         response = self.api.transport.calculate_directions(
             waypoints=query_points,
-            edge_filter='pedestrian',
+            edge_filter=self.EDGE_FILTER,
             alternative=alternative,
         )
         if response['meta']['code'] != 200:
             raise ValidationError(response)
-        legs = response['result']['items'][0]['legs']
-        linestrings = []
-        for leg in legs:
-            for step in leg['steps']:
-                for edge in step['edges']:
-                    linestrings.append(wkt.loads(edge['geometry']['selection']))
-        # Первое и последнее ребро - это отметки нулевой длины
-        final_linestring_positions = []
-        for linestring in linestrings[:-1]:
-            final_linestring_positions.extend(linestring['coordinates'][1:])
-        return LineString(tuple(final_linestring_positions))
+        routes_positions = []
+        for item in response['result']['items']:
+            edges = [edge for leg in item['legs'] for step in leg['steps']
+                     for edge in step['edges']]
+            # Первое и последнее ребро - это отметки нулевой длины
+            linestrings = [parse_linestring(edge['geometry']['selection'])
+                           for edge in edges[:-1]]
+            positions = []
+            for linestring in linestrings:
+                positions.extend(linestring[1:])
+            routes_positions.append(positions)
+        return routes_positions
 
     def _get_route_points_metadata(self, route_points):
         route_points_count = len(route_points)
@@ -78,38 +121,50 @@ class AbstractRouteView(views.APIView):
                 for i in range(1, self.METADATA_ROUTE_POINTS_COUNT)
                 ]
         metadata = []
-        for point in metadata_route_points:
-            response = self.api.geo.search(
-                point='{},{}'.format(*point['coordinates']),
-                fields='items.geometry.selection',
-                radius=100,
-                type='attraction,poi',
-                page_size=1
-            )
-            if response['meta']['code'] == 200:
-                item = response['result']['items'][0]
-                raw_point = wkt.loads(item['geometry']['selection'])
-                position = raw_point['coordinates']
-                item['point'] = {
-                    'longitude': position[0],
-                    'latitude': position[1]
-                }
+        for item in self.executor.map(self._get_point_metadata, metadata_route_points):
+            if item is not None:
                 metadata.append(item)
-            else:
-                pass
         return metadata
 
+    def _get_point_metadata(self, point):
+        response = self.cached_search(
+            self.api.geo.search,
+            {'point': point},
+            fields='items.geometry.selection',
+            radius=self.METADATA_SEARCH_RADIUS,
+            type='attraction,poi',
+            page_size=1
+        )
+        if response['meta']['code'] != 200:
+            return None
+        item = response['result']['items'][0]
+        raw_point = wkt.loads(item['geometry']['selection'])
+        return self._set_metadata_point(item, raw_point['coordinates'])
+
+    def _set_metadata_point(self, item, position):
+        item['point'] = {
+            'longitude': position[0],
+            'latitude': position[1]
+        }
+        return item
+
     def prepare_route_response(self, walking_time, route_points, end_point_metadata=None,
-                               alternatives_count=0):
+                               alternatives_count=0, include_metadata=False):
+        route, *alternative_routes = self.build_routes(route_points, alternatives_count)
+        # Метаданные точек маршрута - это дополнительные запросы к 2GIS,
+        # поэтому они собираются, только если клиент их запросил
         return Response(
             {
                 'walking_time': round(walking_time, 2),
-                'route': self.serialize_linestring(
-                    self.build_route(route_points, alternatives_count)
-                ),
-                'route_points': self._get_route_points_metadata(route_points),
+                'route': self.serialize_linestring(route),
+                'alternative_routes': [
+                    self.serialize_linestring(alternative_route)
+                    for alternative_route in alternative_routes
+                ],
+                'route_points': (self._get_route_points_metadata(route_points)
+                                 if include_metadata else []),
                 'steps_count': round(self.SPEED * walking_time / self.AVERAGE_STRIDE_LENGTH),
-                'end_point_data': end_point_metadata
+                'end_point_data': end_point_metadata if include_metadata else None
             }
         )
 
@@ -118,88 +173,68 @@ class POIRouteView(AbstractRouteView):
     SEARCH_STRING = None
     serializer_class = POIRouteSerializer
     OPTIMAL_WALK_TIME = 30  # в минутах
+    # Расстояние по прямой до точки назначения, при котором время прогулки по кругу
+    # (math.pi * расстояние / SPEED) равно OPTIMAL_WALK_TIME, в метрах
+    OPTIMAL_WALK_DISTANCE = OPTIMAL_WALK_TIME * AbstractRouteView.SPEED / math.pi
+    # Для RANDOM поисковой строки нет, ищутся любые объекты
+    SEARCH_QUERIES = {
+        POIRouteSerializer.BAR: 'Бар',
+        POIRouteSerializer.CULTURE: 'Театр',
+        POIRouteSerializer.FOOD: 'Продукты',
+        POIRouteSerializer.ROMANTIC: 'Кинотеатр',
+        POIRouteSerializer.INVESTIGATE: 'Памятник',
+    }
 
     def get_search_polygon(self, start_point):
-        coordinates = start_point['coordinates']
-        point1 = Point((coordinates[0] - 0.029, coordinates[1] + 0.019))
-        point2 = Point((coordinates[0] + 0.029, coordinates[1] - 0.019))
+        point1 = LL(start_point.lon - 0.029, start_point.lat + 0.019)
+        point2 = LL(start_point.lon + 0.029, start_point.lat - 0.019)
         return point1, point2
 
     def get_search_query_by_type(self, type):
-        if type == POIRouteSerializer.BAR:
-            return 'Бар'
-        elif type == POIRouteSerializer.CULTURE:
-            return 'Театр'
-        elif type == POIRouteSerializer.FOOD:
-            return 'Продукты'
-        elif type == POIRouteSerializer.ROMANTIC:
-            return 'Кинотеатр'
-        elif type == POIRouteSerializer.INVESTIGATE:
-            return 'Памятник'
+        return self.SEARCH_QUERIES.get(type)
+
+    def search_optimal_point(self, start_point, items, positions):
+        # Точка, расстояние до которой ближе всего к оптимальному
+        lons, lats = np.array(positions).T
+        distances = get_great_circle_distances(start_point, lons, lats)
+        index = int(np.argmin(np.abs(distances - self.OPTIMAL_WALK_DISTANCE)))
+        position = positions[index]
+        return LL(*position), self._set_metadata_point(items[index], position)
 
     def search_optimal_organization_point(self, start_point, items):
-        optimal_point = None
-        optimal_time = None
-        metadata = None
-        for item in items:
-            raw_point = item['point']
-            item_point = Point((raw_point['lon'], raw_point['lat']))
-            walking_time = math.pi * self.estimate_walking_time(start_point, item_point)
-            if (optimal_time is None or math.fabs(optimal_time - self.OPTIMAL_WALK_TIME) >
-                math.fabs(walking_time - self.OPTIMAL_WALK_TIME)):
-                optimal_time = walking_time
-                optimal_point = item_point
-                metadata = item
-        position = optimal_point['coordinates']
-        metadata['point'] = {
-            'longitude': position[0],
-            'latitude': position[1]
-        }
-        return optimal_point, metadata
+        # У части организаций в ответе 2GIS нет координат
+        items = [item for item in items if item['point'] is not None]
+        if not items:
+            return None
+        positions = [(item['point']['lon'], item['point']['lat']) for item in items]
+        return self.search_optimal_point(start_point, items, positions)
 
     def search_organization_point(self, start_point, point1, point2, query):
         params = dict(
-            point1='{},{}'.format(*point1['coordinates']),
-            point2='{},{}'.format(*point2['coordinates']),
             fields='items.point',
             type='attraction,building,poi'
         )
         if query is not None:
             params['q'] = query
-        response = self.api.catalog.branch.search(**params)
+        response = self.cached_search(self.api.catalog.branch.search,
+                                      {'point1': point1, 'point2': point2}, **params)
         if response['meta']['code'] != 200:
             raise ValidationError(response)
         return self.search_optimal_organization_point(start_point, response['result']['items'])
 
     def search_optimal_geo_point(self, start_point, items):
-        optimal_point = None
-        optimal_time = None
-        metadata = None
-        for item in items:
-            item_point = wkt.loads(item['geometry']['selection'])
-            walking_time = math.pi * self.estimate_walking_time(start_point, item_point)
-            if (optimal_time is None or math.fabs(optimal_time - self.OPTIMAL_WALK_TIME) >
-                math.fabs(walking_time - self.OPTIMAL_WALK_TIME)):
-                optimal_time = walking_time
-                optimal_point = item_point
-                metadata = item
-        position = optimal_point['coordinates']
-        metadata['point'] = {
-            'longitude': position[0],
-            'latitude': position[1]
-        }
-        return optimal_point, metadata
+        positions = [wkt.loads(item['geometry']['selection'])['coordinates'] for item in items]
+        return self.search_optimal_point(start_point, items, positions)
 
     def search_geo_point(self, start_point, point1, point2, query):
         params = dict(
-            point1='{},{}'.format(*point1['coordinates']),
-            point2='{},{}'.format(*point2['coordinates']),
             fields='items.geometry.selection',
             type='attraction,building,poi'
         )
         if query is not None:
             params['q'] = query
-        response = self.api.geo.search(**params)
+        response = self.cached_search(self.api.geo.search,
+                                      {'point1': point1, 'point2': point2}, **params)
         if response['meta']['code'] == 200:
             return self.search_optimal_geo_point(start_point, response['result']['items'])
         elif query is None:
@@ -208,25 +243,41 @@ class POIRouteView(AbstractRouteView):
     def search_destination(self, start_point, type):
         point1, point2 = self.get_search_polygon(start_point)
         query = self.get_search_query_by_type(type)
-        result_point_data = self.search_geo_point(start_point, point1, point2, query)
-        if result_point_data is None:
-            return self.search_organization_point(start_point, point1, point2, query)
-        return result_point_data
+        # Поиск по геообъектам и по организациям идут параллельно, но результаты
+        # разбираются по порядку: поиск по организациям - только запасной вариант,
+        # чтобы точка назначения не зависела от того, какой ответ пришёл раньше
+        futures = [
+            self.executor.submit(self.search_geo_point, start_point, point1, point2, query),
+            self.executor.submit(self.search_organization_point, start_point, point1, point2,
+                                 query),
+        ]
+        # Ошибка одного из поисков - это промах, пока второй ещё может найти точку
+        error = None
+        for future in futures:
+            try:
+                result_point_data = future.result()
+            except Exception as e:
+                error = e
+                continue
+            if result_point_data is not None:
+                return result_point_data
+        if error is not None:
+            raise error
+        raise ValidationError('Не удалось найти точку назначения')
 
     def post(self, request, format=None):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         raw_point = serializer.data['point']
-        start_point = Point((raw_point['longitude'], raw_point['latitude']))
+        start_point = LL(raw_point['longitude'], raw_point['latitude'])
         end_point, metadata = self.search_destination(start_point, serializer.data['type'])
         walking_time = math.pi * self.estimate_walking_time(start_point, end_point)
-        print(
-            'Оценочное время прогулки {walking_time} минут.'.format(walking_time=walking_time)
-        )
+        logger.debug('Оценочное время прогулки %s минут.', walking_time)
         response = self.prepare_route_response(
             walking_time,
             route_points=self.get_points_for_round_route(start_point, end_point),
-            end_point_metadata=metadata
+            end_point_metadata=metadata,
+            include_metadata=serializer.data['include_metadata']
         )
         return response
 
@@ -240,12 +291,13 @@ class ConcreteRouteView(AbstractRouteView):
         serializer.is_valid(raise_exception=True)
         raw_start_point = serializer.data['start_point']
         raw_end_point = serializer.data['end_point']
-        start_point = Point((raw_start_point['longitude'], raw_start_point['latitude']))
-        end_point = Point((raw_end_point['longitude'], raw_end_point['latitude']))
+        start_point = LL(raw_start_point['longitude'], raw_start_point['latitude'])
+        end_point = LL(raw_end_point['longitude'], raw_end_point['latitude'])
         walking_time = self.estimate_walking_time(start_point, end_point)
         response = self.prepare_route_response(
             walking_time=walking_time,
             route_points=(start_point, end_point),
             alternatives_count=self.ALTERNATIVES_COUNT,
+            include_metadata=serializer.data['include_metadata'],
         )
         return response
@@ -1,4 +1,3 @@
-from geojson import Point
 from geomet import wkt
 from rest_framework import views
 from rest_framework.exceptions import ValidationError
@@ -6,6 +5,7 @@ from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 
 from api.serializers import SearchSerializer
+from utils.double_gis.geometry import LL
 from utils.double_gis.service import DoubleGisService
 
 
@@ -15,7 +15,7 @@ class AbstractSearchView(views.APIView):
     serializer_class = SearchSerializer
 
     def get_region(self, point):
-        response = self.api.region.search(q='{},{}'.format(*point['coordinates']))
+        response = self.api.region.search(q=point.qstr)
         if response['meta']['code'] != 200:
             raise ValidationError(response)
         return response['result']['items'][0]['id']
@@ -25,7 +25,7 @@ class SearchByNameView(AbstractSearchView):
     def post(self, request, format=None):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
-        start_point = Point((serializer.data['longitude'], serializer.data['latitude']))
+        start_point = LL(serializer.data['longitude'], serializer.data['latitude'])
         region_id = self.get_region(start_point)
         response = self.api.catalog.branch.search(
             q=serializer.data['query'],
@@ -68,7 +68,7 @@ class SearchView(AbstractSearchView):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         raw_point = serializer.data['point']
-        start_point = Point((raw_point['longitude'], raw_point['latitude']))
+        start_point = LL(raw_point['longitude'], raw_point['latitude'])
         region_id = self.get_region(start_point)
         response = self.api.geo.search(
             q=serializer.data['query'],
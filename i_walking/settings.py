@@ -88,6 +88,35 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'i_walking',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'routes': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'SERIALIZER': 'django_redis.serializers.msgpack.MSGPackSerializer',
+            # Без Redis маршруты просто строятся заново, а не падают с ошибкой
+            'IGNORE_EXCEPTIONS': True,
+            # Короткие таймауты, чтобы недоступный Redis не задерживал запросы
+            'SOCKET_CONNECT_TIMEOUT': 0.2,  # в секундах
+            'SOCKET_TIMEOUT': 0.2,  # в секундах
+        },
+    },
+}
+
+# Пропущенные ошибки Redis пишутся в лог, чтобы неработающий кэш было видно
+DJANGO_REDIS_LOG_IGNORED_EXCEPTIONS = True
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -1,13 +1,28 @@
+import math
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+EARTH_RADIUS = 6371009  # в метрах, как в geopy
+
+
+class LL(namedtuple('LL', 'lon lat')):
+    # Точка на карте: долгота и широта
+    __slots__ = ()
+
+    @property
+    def qstr(self):
+        # Координаты в формате параметров 2GIS
+        return '%s,%s' % self
+
+
 def get_center_of_points(point1, point2):
-    x1, y1 = point1['coordinates']
-    x2, y2 = point2['coordinates']
-    return (x1 + x2) / 2, (y1 + y2) / 2
+    return (np.asarray(point1) + np.asarray(point2)) / 2
 
 
 def get_point_distance(point1, point2):
-    x1, y1 = point1['coordinates']
-    x2, y2 = point2['coordinates']
-    return ((x1 - x2) ** 2 + (y1 - y2) ** 2) ** (1 / 2)
+    return np.linalg.norm(np.subtract(point1, point2))
 
 
 def get_normal_vector(point1, point2):
@@ -15,10 +30,35 @@ def get_normal_vector(point1, point2):
     # a * x + b * y = 0 - уравнение для вектора, перпендикулярного исходной прямой
     # - x * a / b = y
     # (1, -a / b)
-    x1, y1 = point1['coordinates']
-    x2, y2 = point2['coordinates']
-    point_distance = get_point_distance(point1, point2)
-    normal_vector = (1, - (x2 - x1) / (y2 - y1))
-    normal_vector_length = (normal_vector[0] ** 2 + normal_vector[1] ** 2) ** (1 / 2)
-    normal_vector = normal_vector[0] / normal_vector_length, normal_vector[1] / normal_vector_length
-    return normal_vector[0] * point_distance / 2, normal_vector[1] * point_distance / 2
+    x1, y1 = point1
+    x2, y2 = point2
+    normal_vector = np.array((1, - (x2 - x1) / (y2 - y1)))
+    return normal_vector / np.linalg.norm(normal_vector) * get_point_distance(point1, point2) / 2
+
+
+def get_great_circle_distance(point1, point2):
+    # Расстояние в метрах между двумя точками по формуле гаверсинусов
+    lon1, lat1 = math.radians(point1.lon), math.radians(point1.lat)
+    lon2, lat2 = math.radians(point2.lon), math.radians(point2.lat)
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def get_great_circle_distances(point, lons, lats):
+    # Расстояния в метрах от точки до массива точек по формуле гаверсинусов
+    lon, lat = math.radians(point.lon), math.radians(point.lat)
+    lons = np.radians(lons)
+    lats = np.radians(lats)
+    a = (np.sin((lats - lat) / 2) ** 2 +
+         np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+@lru_cache(maxsize=10000)
+def parse_linestring(raw_linestring):
+    # Разбор 'LINESTRING(x y, x y, ...)' из ответов 2GIS без полного парсера WKT.
+    # 2GIS возвращает много одинаковых коротких рёбер, поэтому разбор кэшируется
+    body = raw_linestring[raw_linestring.index('(') + 1:raw_linestring.rindex(')')]
+    return tuple(tuple(map(float, position.split())) for position in body.split(','))
+
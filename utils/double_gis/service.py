@@ -1,7 +1,23 @@
+import logging
 from urllib.parse import urlencode, urlparse, urlunparse
 
 import requests
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Одна сессия на процесс, чтобы переиспользовать keep-alive соединения с 2GIS
+session = requests.Session()
+session.headers['Connection'] = 'keep-alive'
+session.mount('http://', HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    # raise_on_status=False: после повторов вызывающий код получает ответ 2GIS, а не исключение
+    max_retries=Retry(total=3, backoff_factor=0.1, status_forcelist=(500, 502, 503, 504),
+                      raise_on_status=False),
+))
 
 
 class DoubleGisMethod:
@@ -16,6 +32,9 @@ class DoubleGisMethod:
 
         return DoubleGisMethod(self.api, method)
 
+    def __str__(self):
+        return self._method or ''
+
     def __call__(self, **kwargs):
         return self.api.method(self._method, kwargs)
 
@@ -31,11 +50,10 @@ class DoubleGisService(object):
         return DoubleGisMethod(self)
 
     def method(self, method, params):
+        logger.debug('Запрос к 2GIS %s %s', method, params)
         url_parts = list(urlparse(self.BASE_URL))
         url_parts[2] += method
         params['key'] = self.key
         url_parts[4] = urlencode(params)
         url = urlunparse(url_parts)
-        print(url)
-        print(params)
-        return requests.get(url).json()
+        return session.get(url).json()